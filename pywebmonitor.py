@@ -1,26 +1,62 @@
 import argparse
 import asyncio
+import atexit
+import codecs
 import configparser
 import csv
+import functools
+import hashlib
 import logging
+import logging.handlers
 import os
+import queue
+import random
 import re
 import sys
-from datetime import datetime
+from collections.abc import Awaitable, Callable, Iterable, Iterator
+from types import SimpleNamespace
 from urllib.parse import urlparse
 
 import aiohttp
 import psycopg2
 from psycopg2 import sql
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
+
+# Size of the chunks the response bodies are read in.
+CHUNK_SIZE = 16384
+# Characters that have to follow a match found before the end of the body, so $,
+# \b and lookaheads see what comes after it.
+REGEX_WINDOW = 4096
+# Maximum number of characters of the body kept for the regex search.
+REGEX_MAX_TAIL = 1024 * 1024
+# Maximum number of DB connections, which is also the number of concurrent writes.
+DB_POOL_SIZE = 4
+# Fast paths for the usual shape of the URLs and intervals in the URLs file.
+# Values that don't match them are checked with urlparse and int instead.
+URL_RE = re.compile(r"https?://[A-Za-z0-9._~%!$&'()*+,;=:@-]+(?:[/?#]|\Z)")
+INTERVAL_RE = re.compile(r" *([0-9]{1,3}) *")
+
+logger = logging.getLogger(__name__)
 
 
 def setup_logging(logfile: str) -> None:
-    """Sets up basic logging"""
+    """
+    Sets up basic logging.
+    Records are passed through a queue to a listener thread, which writes them to
+    the logfile and stderr, so the monitor tasks never block on the log writes.
+    """
+    log_queue = queue.SimpleQueue()
     logging.basicConfig(
         level=logging.INFO,
         format="%(asctime)s [%(levelname)s] %(message)s",
-        handlers=[logging.FileHandler(logfile), logging.StreamHandler()],
+        handlers=[logging.handlers.QueueHandler(log_queue)],
+    )
+    listener = logging.handlers.QueueListener(
+        log_queue, logging.FileHandler(logfile), logging.StreamHandler()
     )
+    listener.start()
+    atexit.register(listener.stop)
 
 
 def read_config(
@@ -50,6 +86,17 @@ def read_db_environment_variables() -> dict[str, str | None]:
     }
 
 
+def positive_int(value: str) -> int:
+    """argparse type for options that need a whole number of at least 1."""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value!r} is not an integer")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"{value!r} must be at least 1")
+    return number
+
+
 def parse_arguments():
     """parse the arguments of the script."""
     parser = argparse.ArgumentParser(description="Web Monitoring Script")
@@ -68,6 +115,13 @@ def parse_arguments():
         default="webmonitor.log",
         help="Path to the logfile",
     )
+    parser.add_argument(
+        "-m",
+        "--max-concurrent",
+        type=positive_int,
+        default=100,
+        help="Maximum number of requests in flight at the same time",
+    )
     args = parser.parse_args()
     return args
 
@@ -77,38 +131,50 @@ def get_db_params(filepath: str) -> dict[str, str | None] | None:
         try:
             return read_config(filepath)
         except configparser.Error as e:
-            logging.error(f"Error reading configuration file: {e}")
+            logger.error("Error reading configuration file: %s", e)
         except KeyError as e:
-            logging.error(f"Error finding the section: {e}")
+            logger.error("Error finding the section: %s", e)
 
         return None
     else:
-        logging.info(
-            "Config file not found at {}. Trying environment variables...".format(
-                filepath
-            )
+        logger.info(
+            "Config file not found at %s. Trying environment variables...", filepath
         )
-        return read_db_environment_variables()
+        db_params = read_db_environment_variables()
+        if not any(db_params.values()):
+            logger.error("None of the DB environment variables are set.")
+            return None
+        return db_params
 
 
-def read_urls(filepath: str) -> list[list[str]] | None:
-    """Reads the URLS from the given CSV file"""
+def iter_urls(filepath: str) -> Iterator[list[str]]:
+    """
+    Reads the URLS from the given CSV file one row at a time.
+    Empty lines and lines starting with # are skipped. Rows are split on the first
+    two commas, so the regex pattern may contain commas; only rows with quotes in
+    them go through csv.reader.
+    """
     try:
         with open(filepath, "r") as csvfile:
-            reader = csv.reader(csvfile)
-            urls_data = [row for row in reader]
-        return urls_data
+            for line in csvfile:
+                line = line.rstrip("\r\n")
+                if not line or line.startswith("#"):
+                    continue
+                if '"' in line:
+                    yield next(csv.reader([line]))
+                else:
+                    yield line.split(",", 2)
     except FileNotFoundError:
-        logging.error(f'Error: URLs file "{filepath}" not found.')
+        logger.error('Error: URLs file "%s" not found.', filepath)
     except csv.Error as e:
-        logging.error(f'Error reading CSV file "{filepath}": {e}')
+        logger.error('Error reading CSV file "%s": %s', filepath, e)
     except Exception as e:
-        logging.exception(f"Unexpected error while reading URLs file:")
-
-    return None
+        logger.exception("Unexpected error while reading URLs file:")
 
 
 def is_valid_url(url: str) -> bool:
+    if URL_RE.match(url):
+        return True
     try:
         result = urlparse(url)
         return all([result.scheme, result.netloc])
@@ -118,6 +184,9 @@ def is_valid_url(url: str) -> bool:
 
 def is_valid_interval(interval: str, min_val: int = 5, max_val: int = 300) -> bool:
     """Checks if the interval can be converted to int and it's between min and max values"""
+    match = INTERVAL_RE.fullmatch(interval)
+    if match:
+        return min_val <= int(match.group(1)) <= max_val
     try:
         interval_val = int(interval)
         return isinstance(interval_val, int) and min_val <= interval_val <= max_val
@@ -125,161 +194,428 @@ def is_valid_interval(interval: str, min_val: int = 5, max_val: int = 300) -> bo
         return False
 
 
-def is_valid_regex(regex_pattern: str) -> bool:
-    """Checks if the pattern is a valid regex_pattern or None"""
-    if regex_pattern is None:
-        return True
+@functools.lru_cache(maxsize=None)
+def _compile_regex(regex_pattern: str) -> re.Pattern:
+    """Compiles the pattern once, so URLs with the same pattern share it."""
+    return re.compile(regex_pattern)
+
+
+def try_compile_regex(regex_pattern: str | None) -> tuple[bool, re.Pattern | None]:
+    """
+    Compiles the pattern.
+    Returns whether the pattern is valid, and the compiled pattern or None if the
+    pattern is None or empty.
+    """
+    if not regex_pattern:
+        return True, None
     try:
-        re.compile(regex_pattern)
-        return True
+        return True, _compile_regex(regex_pattern)
     except re.error:
-        return False
+        return False, None
 
 
-def validate_urls(urls_data: list[tuple]) -> list:
-    """Validates the format of URLs data"""
-    validated_urls = []
+def is_valid_regex(regex_pattern: str) -> bool:
+    """Checks if the pattern is a valid regex_pattern or None"""
+    is_valid, _ = try_compile_regex(regex_pattern)
+    return is_valid
 
-    for url, interval, regex_pattern in urls_data:
-        if (
-            is_valid_url(url)
-            and is_valid_interval(interval)
-            and is_valid_regex(regex_pattern)
-        ):
-            validated_urls.append((url, int(interval), regex_pattern))
-        else:
-            logging.warning(f"Invalid URL data: {url}, {interval}, {regex_pattern}")
 
-    return validated_urls
+def validate_urls(
+    urls_data: Iterable[list[str]],
+) -> Iterator[tuple[str, int, re.Pattern | None]]:
+    """
+    Validates the format of URLs data and yields the valid ones.
+    Regex patterns are compiled here once, an empty pattern means no regex check.
+    """
+    for row in urls_data:
+        if len(row) != 3:
+            logger.warning("Invalid URL data: %s", ",".join(row))
+            continue
+
+        url, interval, regex_pattern = row
+        is_valid_pattern, compiled_pattern = try_compile_regex(regex_pattern)
+        if is_valid_url(url) and is_valid_interval(interval) and is_valid_pattern:
+            yield url, int(interval), compiled_pattern
+        else:
+            logger.warning("Invalid URL data: %s, %s, %s", url, interval, regex_pattern)
 
 
-def connect_to_database(db_params: dict[str, str]):
-    """Establishes a connection to the database."""
+def create_connection_pool(db_params: dict[str, str]):
+    """Establishes a pool of connections to the database."""
     try:
-        connection = psycopg2.connect(
+        # minconn is the number of connections the pool keeps open, returned
+        # connections above it are closed, so it's the same as maxconn.
+        connection_pool = ThreadedConnectionPool(
+            DB_POOL_SIZE,
+            DB_POOL_SIZE,
             host=db_params["host"],
             port=db_params["port"],
             user=db_params["user"],
             password=db_params["password"],
             dbname=db_params["dbname"],
         )
-        return connection
+        return connection_pool
     except psycopg2.Error as e:
-        logging.error(f"Error connecting to the database: {e}")
+        logger.error("Error connecting to the database: %s", e)
         return None
 
 
-def create_table_if_not_exists(connection, tablename: str):
-    """Creates a table for storing monitoring results if it doesn't exist."""
+def create_table_if_not_exists(connection_pool, tablename: str):
+    """
+    Creates a table for storing monitoring results if it doesn't exist.
+    Tables created before the page content was replaced by its digest and length
+    get the new columns added.
+    """
+    connection = connection_pool.getconn()
     try:
-        connstring = """
+        connstring = sql.SQL("""
             CREATE TABLE IF NOT EXISTS {table} (
                 id SERIAL PRIMARY KEY,
                 url VARCHAR(255),
                 status INT,
                 regex_match BOOLEAN,
                 response_time FLOAT,
-                page_content TEXT,
+                content_sha256 BYTEA,
+                content_length INT,
                 timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
-            """.format(
-            table=tablename
-        )
-        logging.debug(f"This is the connstring:\n{connstring}")
+            """).format(table=sql.Identifier(tablename))
+        migration = sql.SQL("""
+            ALTER TABLE {table}
+                ADD COLUMN IF NOT EXISTS content_sha256 BYTEA,
+                ADD COLUMN IF NOT EXISTS content_length INT
+            """).format(table=sql.Identifier(tablename))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "This is the connstring:\n%s", connstring.as_string(connection)
+            )
         with connection.cursor() as cursor:
             cursor.execute(connstring)
+            cursor.execute(migration)
         connection.commit()
     except psycopg2.Error as e:
-        logging.error(f"Error creating the table: {e}")
+        logger.error("Error creating the table: %s", e)
+    finally:
+        connection_pool.putconn(connection)
 
 
-def write_to_db(
-    url,
-    http_status,
-    regex_match,
-    response_time,
-    content,
-    database_connection,
-    tablename,
-):
-    """Write the content to the database"""
+def build_insert_query(connection_pool, tablename: str) -> str:
+    """
+    Builds the INSERT statement for the monitoring results table.
+    The table name doesn't change, so it's quoted once here instead of on every write.
+    """
+    connection = connection_pool.getconn()
     try:
-        with database_connection.cursor() as cursor:
-            cursor.execute(
-                sql.SQL(
-                    "INSERT INTO {} (url, status, regex_match, response_time, page_content) VALUES (%s, %s, %s, %s, %s)"
-                ).format(sql.Identifier(tablename)),
-                [
-                    url,
-                    http_status,
-                    regex_match,
-                    response_time,
-                    content,
-                ],
+        return (
+            sql.SQL(
+                "INSERT INTO {} (url, status, regex_match, response_time, content_sha256, content_length) VALUES %s"
             )
+            .format(sql.Identifier(tablename))
+            .as_string(connection)
+        )
+    finally:
+        connection_pool.putconn(connection)
+
+
+def write_to_db(rows: list[tuple], connection_pool, insert_query: str):
+    """
+    Write a batch of monitoring results to the database in one round trip.
+    It's blocking, so it's meant to be run in an executor with a pooled connection.
+    """
+    database_connection = None
+    try:
+        database_connection = connection_pool.getconn()
+        with database_connection.cursor() as cursor:
+            execute_values(cursor, insert_query, rows, page_size=len(rows))
         database_connection.commit()
     except psycopg2.Error as db_error:
-        logging.exception(f"Database error:")
-
-    logging.debug(
-        "{} with response_time {} has been written to the DB successfully.".format(
-            url, response_time
+        logger.exception("Database error:")
+        if database_connection is not None:
+            try:
+                database_connection.rollback()
+            except psycopg2.Error:
+                logger.exception("Error rolling back the transaction:")
+        return
+    finally:
+        if database_connection is not None:
+            connection_pool.putconn(database_connection)
+
+    logger.debug("%d rows have been written to the DB successfully.", len(rows))
+
+
+def log_write_error(future: asyncio.Future):
+    """Logs the error of a failed write_to_db call run in the executor."""
+    if future.cancelled():
+        return
+    try:
+        future.result()
+    except Exception:
+        logger.exception("Error writing the results to the DB:")
+
+
+async def db_flusher(
+    write_queue: asyncio.Queue,
+    connection_pool,
+    insert_query: str,
+    batch_size: int = 500,
+    max_latency: float = 2.0,
+    max_writers: int = DB_POOL_SIZE,
+):
+    """
+    Drain monitoring results from the write queue and write them in batches.
+    A batch is flushed once batch_size rows are collected or max_latency seconds
+    have passed since its first row arrived, whichever comes first.
+    Batches are written in the default executor so the event loop isn't blocked,
+    with at most max_writers writes in flight.
+    When it's cancelled, the rows left in the queue and the current batch are
+    written, and the writes in flight are waited for, before it stops.
+    """
+    loop = asyncio.get_running_loop()
+    pending = set()
+
+    async def start_write(rows: list[tuple]):
+        nonlocal pending
+        if len(pending) >= max_writers:
+            _, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+        write = loop.run_in_executor(
+            None, write_to_db, rows, connection_pool, insert_query
         )
-    )
+        write.add_done_callback(log_write_error)
+        pending.add(write)
+
+    rows = []
+    try:
+        while True:
+            rows.append(await write_queue.get())
+            # Unlike wait_for, timeout_at doesn't swallow a cancellation that
+            # arrives just as a row does.
+            try:
+                async with asyncio.timeout_at(loop.time() + max_latency):
+                    while len(rows) < batch_size:
+                        rows.append(await write_queue.get())
+            except TimeoutError:
+                pass
+
+            await start_write(rows)
+            rows = []
+    except asyncio.CancelledError:
+        while not write_queue.empty():
+            rows.append(write_queue.get_nowait())
+        if rows:
+            logger.info("Writing the remaining %d results to the DB.", len(rows))
+            await start_write(rows)
+        if pending:
+            await asyncio.wait(pending)
+        raise
+
+
+async def read_body(response: aiohttp.ClientResponse) -> tuple[bytes, int, None]:
+    """
+    Reads the response body in chunks and hashes it, for URLs without a regex pattern.
+    Returns the SHA-256 digest and the length of the body.
+    """
+    digest = hashlib.sha256()
+    length = 0
+    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+        digest.update(chunk)
+        length += len(chunk)
+
+    return digest.digest(), length, None
+
+
+async def read_and_match(
+    response: aiohttp.ClientResponse, regex_pattern: re.Pattern
+) -> tuple[bytes, int, bool]:
+    """
+    Reads the response body in chunks, hashes it and checks it for the regex pattern.
+    Returns the SHA-256 digest and the length of the body with the regex match.
+    Like response.text(), the body is decoded with the charset of the response or
+    UTF-8, undecodable bytes are replaced.
+    The body is searched again each time it has doubled in size, and the search
+    stops at the first match. Before the end of the body, a match only counts if
+    at least REGEX_WINDOW + len(pattern) characters follow it, so $, \b and
+    lookaheads see what comes after it. Only the last REGEX_MAX_TAIL characters
+    are kept, halving it when it's full, so matches longer than REGEX_MAX_TAIL / 2
+    can be missed.
+    """
+    try:
+        decoder = codecs.getincrementaldecoder(response.charset or "utf-8")("replace")
+    except LookupError:
+        decoder = codecs.getincrementaldecoder("utf-8")("replace")
+    digest = hashlib.sha256()
+    length = 0
+    tail = ""
+    new_text = []
+    new_length = 0
+    search_from = 0
+    regex_match = False
+    window = REGEX_WINDOW + len(regex_pattern.pattern)
+
+    chunks = response.content.iter_chunked(CHUNK_SIZE)
+    async for chunk in chunks:
+        digest.update(chunk)
+        length += len(chunk)
+        text = decoder.decode(chunk)
+        new_text.append(text)
+        new_length += len(text)
+        # Searching only once the tail has doubled keeps the work linear.
+        if new_length < len(tail):
+            continue
+        tail += "".join(new_text)
+        new_text.clear()
+        new_length = 0
+        match = regex_pattern.search(tail, search_from)
+        if match and match.end() <= len(tail) - window:
+            regex_match = True
+            break
+        if len(tail) > REGEX_MAX_TAIL:
+            tail = tail[-(REGEX_MAX_TAIL // 2) :]
+            # The first window of the tail is only kept as context, so it's not
+            # mistaken for the start of the body by anchors and lookbehinds.
+            search_from = window
+    else:
+        # The body has ended, so the matches left at the end of it count too.
+        new_text.append(decoder.decode(b"", final=True))
+        tail += "".join(new_text)
+        regex_match = bool(regex_pattern.search(tail, search_from))
+
+    # The rest of the body, if any, only needs to be hashed.
+    async for chunk in chunks:
+        digest.update(chunk)
+        length += len(chunk)
+
+    return digest.digest(), length, regex_match
+
+
+async def on_connection_queued_start(session, trace_config_ctx, params):
+    trace_config_ctx.queued_at = asyncio.get_running_loop().time()
 
 
-async def monitor_urls(url, regex_pattern, interval, database_connection, tablename):
+async def on_connection_queued_end(session, trace_config_ctx, params):
+    queued_time = asyncio.get_running_loop().time() - trace_config_ctx.queued_at
+    trace_config_ctx.trace_request_ctx.queued_time += queued_time
+
+
+def create_trace_config() -> aiohttp.TraceConfig:
+    """
+    Creates a trace config that adds up the time a request waits for a free
+    connection from the connector into its trace_request_ctx.queued_time, so it can
+    be left out of the response time.
+    """
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_connection_queued_start.append(on_connection_queued_start)
+    trace_config.on_connection_queued_end.append(on_connection_queued_end)
+    return trace_config
+
+
+def make_body_reader(
+    regex_pattern: re.Pattern | None,
+) -> Callable[[aiohttp.ClientResponse], Awaitable[tuple[bytes, int, bool | None]]]:
+    """
+    Picks the body reader for a URL once, so monitor_urls doesn't have to check
+    whether there's a regex pattern on every poll.
+    """
+    if regex_pattern is None:
+        return read_body
+    return functools.partial(read_and_match, regex_pattern=regex_pattern)
+
+
+async def monitor_urls(
+    url: str,
+    regex_pattern: re.Pattern | None,
+    interval: int,
+    session: aiohttp.ClientSession,
+    semaphore: asyncio.Semaphore,
+    write_queue: asyncio.Queue,
+):
     """
     Monitor URLs in a concurrent way.
-    Asynchronously get the URLs, check for regex match, and then write the result to the DB.
-    Writing to DB uses the same connection for now. Doesn't break the concurrency.
+    Asynchronously get the URLs, check for regex match, and then queue the result
+    for the db_flusher task to write to the DB.
+    All tasks share the same session, so connections are kept alive between polls,
+    and the same semaphore, which limits the number of requests in flight.
+    The time spent waiting for the semaphore or for a free connection from the
+    connector is not counted in the response time.
+    Polls are scheduled on fixed deadlines, interval seconds apart, so the time the
+    request takes doesn't add up to the period. The first deadline is picked randomly
+    within the first interval, so the tasks don't all poll at the same moment.
     """
+    read_response_body = make_body_reader(regex_pattern)
+    loop = asyncio.get_running_loop()
+    next_deadline = loop.time() + random.uniform(0, interval)
     while True:
-        async with aiohttp.ClientSession() as session:
-            start_time = datetime.now()
-            logging.debug(f"Start time {start_time} for url {url}")
+        await asyncio.sleep(max(0, next_deadline - loop.time()))
+
+        async with semaphore:
+            start_time = loop.time()
+            timing = SimpleNamespace(queued_time=0.0)
+            logger.debug("Sending request for url %s", url)
 
-            async with session.get(url) as response:
-                end_time = datetime.now()
-                response_time = (end_time - start_time).total_seconds()
+            async with session.get(url, trace_request_ctx=timing) as response:
+                response_time = loop.time() - start_time - timing.queued_time
 
                 http_status = response.status
-                content = await response.text()
-                logging.debug("Response received for %s", url)
-                logging.debug(
-                    f"End time {end_time} for url {url}, took {response_time} seconds"
+                content_sha256, content_length, regex_match = await read_response_body(
+                    response
                 )
-                logging.debug("Body: {}...".format(content[:15]))
-                regex_match = None
-                if regex_pattern is not None:
-                    regex_match = bool(re.search(regex_pattern, content))
-
-                write_to_db(
-                    url,
-                    http_status,
-                    regex_match,
-                    response_time,
-                    content,
-                    database_connection,
-                    tablename,
+                logger.debug("Response received for %s", url)
+                logger.debug("Request for url %s took %s seconds", url, response_time)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(
+                        "Body: %d bytes, sha256 %s",
+                        content_length,
+                        content_sha256.hex(),
+                    )
+
+                await write_queue.put(
+                    (
+                        url,
+                        http_status,
+                        regex_match,
+                        response_time,
+                        content_sha256,
+                        content_length,
+                    )
                 )
 
-        logging.debug(
-            "Sleeping now for {} with response_time:{} for {} seconds".format(
-                url, response_time, interval
-            )
+        next_deadline += interval
+        # Don't try to catch up on missed deadlines if the request took too long.
+        next_deadline = max(next_deadline, loop.time())
+        logger.debug(
+            "Sleeping now for %s with response_time:%s for %s seconds",
+            url,
+            response_time,
+            next_deadline - loop.time(),
         )
-        await asyncio.sleep(interval)
-        logging.debug("Woke up for {} after {} seconds.".format(url, interval))
 
 
-async def main_async_monitor_urls(urls: list, database_connection, tablename: str):
-    """Asynchronously monitor multiple URLs."""
-    tasks = [
-        monitor_urls(url, regex_pattern, interval, database_connection, tablename)
-        for url, interval, regex_pattern in urls
-    ]
-    await asyncio.gather(*tasks)
+async def main_async_monitor_urls(
+    urls: list, connection_pool, insert_query: str, max_concurrent: int = 100
+):
+    """
+    Asynchronously monitor multiple URLs.
+    At most max_concurrent requests are in flight at the same time.
+    """
+    write_queue = asyncio.Queue()
+    semaphore = asyncio.Semaphore(max_concurrent)
+    connector = aiohttp.TCPConnector(
+        limit=max_concurrent,
+        limit_per_host=4,
+        ttl_dns_cache=300,
+        keepalive_timeout=75,
+    )
+    async with aiohttp.ClientSession(
+        connector=connector, trace_configs=[create_trace_config()]
+    ) as session:
+        tasks = [
+            monitor_urls(url, regex_pattern, interval, session, semaphore, write_queue)
+            for url, interval, regex_pattern in urls
+        ]
+        await asyncio.gather(
+            db_flusher(write_queue, connection_pool, insert_query), *tasks
+        )
 
 
 def main():
@@ -290,47 +626,46 @@ def main():
 
     # Get DB Params
     db_params = get_db_params(args.config)
-    if db_params == None:
-        sys.exit()
-    logging.debug("Database parameters: %s", db_params)
+    if db_params is None or not any(db_params.values()):
+        logger.error("No DB config, exiting...")
+        sys.exit(2)
+    logger.debug("Database parameters: %s", db_params)
+    tablename = db_params["tablename"]
 
     # Connect to the database
-    db_connection = connect_to_database(db_params)
-    if db_connection is None:
+    connection_pool = create_connection_pool(db_params)
+    if connection_pool is None:
         sys.exit()
-    logging.info("Connected to the {} database.".format(db_params["dbname"]))
+    logger.info("Connected to the %s database.", db_params["dbname"])
 
     # Create monitoring results table if not exists
-    create_table_if_not_exists(db_connection, db_params["tablename"])
-    logging.info(
-        "Ensured that the {} table exists in {} database.".format(
-            db_params["tablename"], db_params["dbname"]
-        )
+    create_table_if_not_exists(connection_pool, tablename)
+    logger.info(
+        "Ensured that the %s table exists in %s database.",
+        tablename,
+        db_params["dbname"],
     )
+    insert_query = build_insert_query(connection_pool, tablename)
 
-    # Check if the URLs file exists
-    urls_data = read_urls(args.urls)
-    logging.info(f'URLs file "{args.urls}" read successfully.')
-
-    # Validate the URLs
-    validated_urls = validate_urls(urls_data)
-    logging.debug("Validated URLs: %s", validated_urls)
+    # Read and validate the URLs
+    validated_urls = list(validate_urls(iter_urls(args.urls)))
+    logger.debug("Validated URLs: %s", validated_urls)
 
     if len(validated_urls) == 0:
-        logging.info("There are no Valid URLs to check, exiting...")
+        logger.info("There are no Valid URLs to check, exiting...")
         sys.exit()
 
-    logging.info("Monitoring the URLs now.")
+    logger.info("Monitoring the URLs now.")
 
     # Run the main_async function to asynchronously monitor URLs
     try:
         asyncio.run(
             main_async_monitor_urls(
-                validated_urls, db_connection, db_params["tablename"]
+                validated_urls, connection_pool, insert_query, args.max_concurrent
             )
         )
     except KeyboardInterrupt:
-        logging.info("Monitoring interrupted. Exiting...")
+        logger.info("Monitoring interrupted. Exiting...")
 
 
 if __name__ == "__main__":
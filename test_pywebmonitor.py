@@ -1,18 +1,32 @@
+import argparse
+import asyncio
+import hashlib
 import logging
+import re
 from pathlib import Path
 from typing import Any
-from unittest.mock import MagicMock, Mock, patch
+from unittest.mock import DEFAULT, MagicMock, Mock, patch
 
+import psycopg2
 import pytest
 
 from pywebmonitor import (
+    create_table_if_not_exists,
+    db_flusher,
     get_db_params,
     is_valid_interval,
     is_valid_regex,
     is_valid_url,
-    read_urls,
+    iter_urls,
+    make_body_reader,
+    monitor_urls,
+    positive_int,
+    read_and_match,
+    read_body,
     setup_logging,
+    try_compile_regex,
     validate_urls,
+    write_to_db,
 )
 
 
@@ -53,6 +67,32 @@ def mock_db_connection():
     return MagicMock()
 
 
+@pytest.fixture
+def mock_connection_pool(mock_db_connection):
+    connection_pool = MagicMock()
+    connection_pool.getconn.return_value = mock_db_connection
+    return connection_pool
+
+
+def mock_response(*chunks: bytes, charset: str | None = None):
+    async def iter_chunked(size):
+        for chunk in chunks:
+            yield chunk
+
+    response = MagicMock()
+    response.content.iter_chunked = iter_chunked
+    response.charset = charset
+    return response
+
+
+def mock_session(status: int, body: bytes):
+    response = mock_response(body)
+    response.status = status
+    session = MagicMock()
+    session.get.return_value.__aenter__.return_value = response
+    return session
+
+
 @pytest.mark.skip(reason="not writing any data to the logs at this point")
 def test_setup_logging(setup_logging_fixture: Any):
     assert setup_logging_fixture.is_file()
@@ -81,15 +121,7 @@ def test_get_db_params_with_existing_file(
 def test_get_db_params_with_nonexistent_file_without_any_env_vars():
     # Test with non-existent file
     result = get_db_params("nonexistent_file.ini")
-    expected_result = {
-        "host": None,
-        "port": None,
-        "user": None,
-        "password": None,
-        "dbname": None,
-        "tablename": None,
-    }
-    assert result == expected_result
+    assert result is None
 
 
 def test_get_db_params_with_env_variables(monkeypatch: pytest.MonkeyPatch):
@@ -125,45 +157,78 @@ def test_get_db_params_with_invalid_file(tmp_path: Path):
     assert result is None
 
 
-def test_read_urls_with_valid_csv(valid_csv_path):
-    result = read_urls(valid_csv_path)
+def test_iter_urls_with_valid_csv(valid_csv_path):
+    result = list(iter_urls(valid_csv_path))
     assert result == [
         ["https://example.com", "10", "regex_pattern"],
         ["https://example2.com", "20", "regex_pattern2"],
     ]
 
 
-def test_read_urls_with_invalid_csv(invalid_csv_path, caplog):
+def test_iter_urls_with_invalid_csv(invalid_csv_path, caplog):
     # We're parsing invalid CSVs too. We just don't validate them.
-    result = read_urls(invalid_csv_path)
-    assert result is not None
+    result = list(iter_urls(invalid_csv_path))
+    assert result == [["invalid data"]]
 
 
-def test_read_urls_with_nonexistent_file(caplog):
-    result = read_urls("nonexistent_file.csv")
-    assert result is None
+def test_iter_urls_skips_comments_and_keeps_commas_in_regex(tmpdir):
+    csv_file = tmpdir.join("urls.csv")
+    csv_file.write(
+        '# url, interval, regex\n\nhttps://example.com,10,a{1,3}\nhttps://example2.com,20,"b,c"\n'
+    )
+    result = list(iter_urls(str(csv_file)))
+    assert result == [
+        ["https://example.com", "10", "a{1,3}"],
+        ["https://example2.com", "20", "b,c"],
+    ]
+
+
+def test_iter_urls_with_nonexistent_file(caplog):
+    result = list(iter_urls("nonexistent_file.csv"))
+    assert result == []
     assert 'Error: URLs file "nonexistent_file.csv" not found.' in caplog.text
 
 
 def test_is_valid_url():
     assert is_valid_url("http://www.example.com")
     assert is_valid_url("https://example.com/path?query=value")
+    assert is_valid_url("ftp://example.com")
+    assert is_valid_url("http://[::1]/path")
     assert not is_valid_url("invalidurl")
+    assert not is_valid_url("http://example.com[")
 
 
 def test_is_valid_interval():
     assert is_valid_interval("10")
     assert is_valid_interval("100", min_val=50, max_val=200)
+    assert is_valid_interval(" 10")
+    assert is_valid_interval("0010")
     assert not is_valid_interval("abc")
+    assert not is_valid_interval("1000")
     assert not is_valid_interval("500", min_val=50, max_val=200)
 
 
+def test_positive_int():
+    assert positive_int("1") == 1
+    assert positive_int("100") == 100
+    for value in ("0", "-5", "abc", "1.5"):
+        with pytest.raises(argparse.ArgumentTypeError):
+            positive_int(value)
+
+
 def test_is_valid_regex():
     assert is_valid_regex(None)
     assert is_valid_regex(r"\d+")
     assert not is_valid_regex("[a-z")
 
 
+def test_try_compile_regex():
+    assert try_compile_regex(None) == (True, None)
+    assert try_compile_regex("") == (True, None)
+    assert try_compile_regex(r"\d+") == (True, re.compile(r"\d+"))
+    assert try_compile_regex("[a-z") == (False, None)
+
+
 def test_validate_urls(caplog):
     urls_data_valid = [
         ("http://www.example.com", "10", r"\w+"),
@@ -172,17 +237,343 @@ def test_validate_urls(caplog):
     urls_data_invalid = [
         ("invalidurl", "20", r"\d+"),
         ("http://www.example.com", "NaN", r"\w+"),
+        ["invalid data"],
     ]
 
-    validated_urls = validate_urls(urls_data_valid)
+    validated_urls = list(validate_urls(urls_data_valid))
     assert len(validated_urls) == len(urls_data_valid)
+    assert validated_urls[0] == ("http://www.example.com", 10, re.compile(r"\w+"))
 
     caplog.set_level(logging.WARN)
 
     # Somehow the root logger is not captured here.
     # Commenting out for now.
     # with pytest.warns(Warning, match="Invalid URL data"):
-    #   invalid_urls = validate_urls(urls_data_invalid)
+    #   invalid_urls = list(validate_urls(urls_data_invalid))
 
-    invalid_urls = validate_urls(urls_data_invalid)
+    invalid_urls = list(validate_urls(urls_data_invalid))
     assert len(invalid_urls) == 0
+
+
+def test_validate_urls_shares_duplicate_patterns():
+    validated_urls = list(
+        validate_urls(
+            [
+                ("https://en.wikipedia.org/wiki/1", "10", "one"),
+                ("https://en.wikipedia.org/wiki/2", "20", "one"),
+            ]
+        )
+    )
+    assert validated_urls[0][2] is validated_urls[1][2]
+
+
+def test_validate_urls_without_regex():
+    validated_urls = list(validate_urls([("http://www.example.com", "10", "")]))
+    assert validated_urls == [("http://www.example.com", 10, None)]
+
+
+def test_create_table_if_not_exists_adds_new_columns(
+    mock_connection_pool, mock_db_connection
+):
+    create_table_if_not_exists(mock_connection_pool, "results")
+
+    cursor = mock_db_connection.cursor.return_value.__enter__.return_value
+    create, migration = [c.args[0] for c in cursor.execute.call_args_list]
+    assert "CREATE TABLE IF NOT EXISTS" in repr(create)
+    assert "ADD COLUMN IF NOT EXISTS content_sha256 BYTEA" in repr(migration)
+    assert "ADD COLUMN IF NOT EXISTS content_length INT" in repr(migration)
+    mock_db_connection.commit.assert_called_once()
+    mock_connection_pool.putconn.assert_called_once_with(mock_db_connection)
+
+
+@patch("pywebmonitor.execute_values")
+def test_write_to_db_batches_rows(
+    mock_execute_values, mock_connection_pool, mock_db_connection
+):
+    rows = [
+        ("http://www.example.com", 200, True, 0.1, b"\x00" * 32, 1256),
+        ("https://example.com/path", 404, None, 0.2, b"\x01" * 32, 9),
+    ]
+
+    write_to_db(rows, mock_connection_pool, "INSERT INTO results VALUES %s")
+
+    mock_execute_values.assert_called_once()
+    assert mock_execute_values.call_args.args[1:3] == (
+        "INSERT INTO results VALUES %s",
+        rows,
+    )
+    mock_db_connection.commit.assert_called_once()
+    mock_connection_pool.putconn.assert_called_once_with(mock_db_connection)
+
+
+def test_write_to_db_without_connection(mock_connection_pool, caplog):
+    mock_connection_pool.getconn.side_effect = psycopg2.OperationalError("no conn")
+
+    write_to_db(
+        [("http://www.example.com", 200, None, 0.1, b"", 0)], mock_connection_pool, ""
+    )
+
+    assert "Database error" in caplog.text
+    mock_connection_pool.putconn.assert_not_called()
+
+
+def test_write_to_db_with_failing_rollback(
+    mock_connection_pool, mock_db_connection, caplog
+):
+    mock_db_connection.commit.side_effect = psycopg2.OperationalError("closed")
+    mock_db_connection.rollback.side_effect = psycopg2.InterfaceError("closed")
+
+    with patch("pywebmonitor.execute_values"):
+        write_to_db(
+            [("http://www.example.com", 200, None, 0.1, b"", 0)],
+            mock_connection_pool,
+            "",
+        )
+
+    assert "Error rolling back the transaction" in caplog.text
+    mock_connection_pool.putconn.assert_called_once_with(mock_db_connection)
+
+
+@patch("pywebmonitor.write_to_db")
+def test_db_flusher_writes_remaining_rows_when_cancelled(
+    mock_write_to_db, mock_connection_pool
+):
+    async def run_flusher():
+        write_queue = asyncio.Queue()
+        write_queue.put_nowait(("http://www.example.com", 200, None, 0.1, b"", 0))
+        flusher = asyncio.create_task(
+            db_flusher(write_queue, mock_connection_pool, "", batch_size=2)
+        )
+        await asyncio.sleep(0.05)
+        # The first row is in the current batch, these two are still queued.
+        write_queue.put_nowait(("https://example.com/path", 200, None, 0.2, b"", 0))
+        write_queue.put_nowait(("https://example.com/path", 200, None, 0.3, b"", 0))
+        flusher.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await flusher
+
+    asyncio.run(run_flusher())
+
+    written = [row for c in mock_write_to_db.call_args_list for row in c.args[0]]
+    assert [row[3] for row in written] == [0.1, 0.2, 0.3]
+
+
+@patch("pywebmonitor.write_to_db", side_effect=RuntimeError("write failed"))
+def test_db_flusher_logs_failed_writes(mock_write_to_db, mock_connection_pool, caplog):
+    async def run_flusher():
+        write_queue = asyncio.Queue()
+        write_queue.put_nowait(("http://www.example.com", 200, None, 0.1, b"", 0))
+        flusher = asyncio.create_task(
+            db_flusher(write_queue, mock_connection_pool, "", max_latency=0.01)
+        )
+        await asyncio.sleep(0.05)
+        flusher.cancel()
+
+    asyncio.run(run_flusher())
+
+    assert "Error writing the results to the DB" in caplog.text
+    assert "write failed" in caplog.text
+
+
+@patch("pywebmonitor.write_to_db")
+def test_db_flusher_flushes_full_batches(mock_write_to_db, mock_connection_pool):
+    async def run_flusher():
+        write_queue = asyncio.Queue()
+        for i in range(5):
+            write_queue.put_nowait(("http://www.example.com", 200, None, i, b"", 0))
+        flusher = asyncio.create_task(
+            db_flusher(write_queue, mock_connection_pool, "results", batch_size=2)
+        )
+        await asyncio.sleep(0.05)
+        flusher.cancel()
+
+    asyncio.run(run_flusher())
+
+    batch_sizes = [len(c.args[0]) for c in mock_write_to_db.call_args_list]
+    # The last row is written when the flusher is cancelled.
+    assert batch_sizes == [2, 2, 1]
+
+
+@patch("pywebmonitor.write_to_db")
+def test_db_flusher_flushes_after_max_latency(mock_write_to_db, mock_connection_pool):
+    async def run_flusher():
+        write_queue = asyncio.Queue()
+        write_queue.put_nowait(("http://www.example.com", 200, None, 0.1, b"", 0))
+        flusher = asyncio.create_task(
+            db_flusher(write_queue, mock_connection_pool, "results", max_latency=0.01)
+        )
+        await asyncio.sleep(0.05)
+        flusher.cancel()
+
+    asyncio.run(run_flusher())
+
+    mock_write_to_db.assert_called_once()
+    assert len(mock_write_to_db.call_args.args[0]) == 1
+
+
+def test_read_body():
+    digest, length, regex_match = asyncio.run(
+        read_body(mock_response(b"Example ", b"Domain"))
+    )
+    assert digest == hashlib.sha256(b"Example Domain").digest()
+    assert length == len(b"Example Domain")
+    assert regex_match is None
+
+
+def test_read_and_match_across_chunks():
+    response = mock_response(b"<h1>Example Do", b"main</h1>", b"<p>more</p>")
+    digest, length, regex_match = asyncio.run(
+        read_and_match(response, re.compile(r"Example Domain"))
+    )
+    assert digest == hashlib.sha256(b"<h1>Example Domain</h1><p>more</p>").digest()
+    assert length == len(b"<h1>Example Domain</h1><p>more</p>")
+    assert regex_match is True
+
+
+@patch("pywebmonitor.REGEX_WINDOW", 4)
+@patch("pywebmonitor.REGEX_MAX_TAIL", 16)
+def test_read_and_match_anchor_after_trimming():
+    response = mock_response(b"zero", b"one" * 10, b"one")
+    _, _, regex_match = asyncio.run(read_and_match(response, re.compile(r"^one")))
+    assert regex_match is False
+
+
+@pytest.mark.parametrize("pattern", [r"Example.*", r"<title>.+", r"title>.*</html"])
+def test_read_and_match_greedy_pattern_on_single_line_body(pattern):
+    body = (
+        b"<html><head><title>Example Domain</title></head><body>"
+        + b"x" * 60000
+        + b"</body></html>"
+    )
+    chunks = [body[i : i + 16384] for i in range(0, len(body), 16384)]
+
+    _, _, regex_match = asyncio.run(
+        read_and_match(mock_response(*chunks), re.compile(pattern))
+    )
+    assert regex_match is True
+
+
+@pytest.mark.parametrize(
+    "pattern, chunks, charset",
+    [
+        # The first ä is split between the chunks.
+        (r"ä{2}", ("<p>ää</p>".encode()[:4], "<p>ää</p>".encode()[4:]), None),
+        (r"(?i)ÄRZTE", ("<p>ärzte</p>".encode(),), "utf-8"),
+        (r"Stra\w+e", ("<p>Straße</p>".encode(),), None),
+        (r"café", ("<p>café</p>".encode("latin-1"),), "iso-8859-1"),
+    ],
+)
+def test_read_and_match_decodes_the_body(pattern, chunks, charset):
+    _, _, regex_match = asyncio.run(
+        read_and_match(mock_response(*chunks, charset=charset), re.compile(pattern))
+    )
+    assert regex_match is True
+
+
+@pytest.mark.parametrize("regex_window", [0, 4096])
+@pytest.mark.parametrize(
+    "pattern, chunks",
+    [
+        (r"Dom\b", (b"<p>Example Dom", b"ain</p>")),
+        (r"Example(?! Domain)", (b"<p>Example", b" Domain</p>")),
+        (r"Domain$", (b"Example Domain", b" more")),
+    ],
+)
+def test_read_and_match_needs_context_after_chunk(regex_window, pattern, chunks):
+    with patch("pywebmonitor.REGEX_WINDOW", regex_window):
+        _, _, regex_match = asyncio.run(
+            read_and_match(mock_response(*chunks), re.compile(pattern))
+        )
+    assert regex_match is bool(re.search(pattern, b"".join(chunks).decode()))
+    assert regex_match is False
+
+
+@patch("pywebmonitor.REGEX_WINDOW", 0)
+def test_read_and_match_at_end_of_body():
+    response = mock_response(b"<p>Example", b" Domain")
+    _, _, regex_match = asyncio.run(read_and_match(response, re.compile(r"Domain$")))
+    assert regex_match is True
+
+
+@patch("pywebmonitor.random.uniform", return_value=0.5)
+def test_monitor_urls_polls_on_interval(mock_uniform):
+    class StopMonitor(Exception):
+        pass
+
+    clock = [100.0]
+    sleeps = []
+    # The second request takes longer than the interval.
+    request_times = iter([3, 12, 3])
+
+    async def fake_sleep(delay):
+        sleeps.append(delay)
+        clock[0] += delay
+        if len(sleeps) == 4:
+            raise StopMonitor()
+
+    def fake_get(url, **kwargs):
+        clock[0] += next(request_times)
+        return DEFAULT
+
+    session = mock_session(200, b"Example Domain")
+    session.get.side_effect = fake_get
+
+    async def run_monitor():
+        write_queue = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        with patch.object(loop, "time", lambda: clock[0]), patch(
+            "pywebmonitor.asyncio.sleep", fake_sleep
+        ), pytest.raises(StopMonitor):
+            await monitor_urls(
+                "http://example.com",
+                re.compile(r"Example"),
+                10,
+                session,
+                asyncio.Semaphore(1),
+                write_queue,
+            )
+        return [write_queue.get_nowait() for _ in range(write_queue.qsize())]
+
+    results = asyncio.run(run_monitor())
+
+    # The first poll is at the random offset, then they're 10 seconds apart,
+    # except after the slow request which isn't caught up on.
+    assert sleeps == [0.5, 7, 0, 7]
+    assert [row[3] for row in results] == [3, 12, 3]
+    url, http_status, regex_match, _, _, content_length = results[0]
+    assert (url, http_status, regex_match) == ("http://example.com", 200, True)
+    assert content_length == len(b"Example Domain")
+
+
+def test_make_body_reader():
+    assert make_body_reader(None) is read_body
+
+    body_reader = make_body_reader(re.compile(r"Domain"))
+    _, _, regex_match = asyncio.run(body_reader(mock_response(b"Example Domain")))
+    assert regex_match is True
+
+
+@patch("pywebmonitor.random.uniform", return_value=0)
+def test_monitor_urls_response_time_excludes_semaphore_wait(mock_uniform):
+    async def run_monitor():
+        write_queue = asyncio.Queue()
+        semaphore = asyncio.Semaphore(1)
+        await semaphore.acquire()
+        monitor = asyncio.create_task(
+            monitor_urls(
+                "http://example.com",
+                None,
+                10,
+                mock_session(200, b"Example Domain"),
+                semaphore,
+                write_queue,
+            )
+        )
+        await asyncio.sleep(0.3)
+        semaphore.release()
+        result = await write_queue.get()
+        monitor.cancel()
+        return result
+
+    _, _, _, response_time, _, _ = asyncio.run(run_monitor())
+    assert response_time < 0.1